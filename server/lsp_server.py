@@ -382,7 +382,7 @@ def _get_global_defaults():
 
 def _update_workspace_settings(settings):
     if not settings:
-        key = utils.normalize_path(os.getcwd())
+        key = utils.normalize_path_cached(os.getcwd())
         WORKSPACE_SETTINGS[key] = {
             "cwd": key,
             "workspaceFS": key,
@@ -392,7 +392,7 @@ def _update_workspace_settings(settings):
         return
 
     for setting in settings:
-        key = utils.normalize_path(uris.to_fs_path(setting["workspace"]))
+        key = utils.normalize_path_cached(uris.to_fs_path(setting["workspace"]))
         WORKSPACE_SETTINGS[key] = {
             **setting,
             "workspaceFS": key,
@@ -403,7 +403,7 @@ def _get_settings_by_path(file_path: pathlib.Path):
     workspaces = {s["workspaceFS"] for s in WORKSPACE_SETTINGS.values()}
 
     while file_path != file_path.parent:
-        str_file_path = utils.normalize_path(file_path)
+        str_file_path = utils.normalize_path_cached(file_path)
         if str_file_path in workspaces:
             return WORKSPACE_SETTINGS[str_file_path]
         file_path = file_path.parent
@@ -424,7 +424,7 @@ def _get_document_key(document: workspace.Document):
         # Find workspace settings for the given file.
         while document_workspace != document_workspace.parent:
             # log_to_output(f'_get_document_key: document_workspace.parent : {document_workspace.parent}')
-            norm_path = utils.normalize_path(document_workspace)
+            norm_path = utils.normalize_path_cached(document_workspace)
             # log_to_output(f'_get_document_key:norm_path : {norm_path}')
             if norm_path in workspaces:
                 return norm_path
@@ -440,7 +440,7 @@ def _get_settings_by_document(document: workspace.Document | None):
     key = _get_document_key(document)
     if key is None:
         # This is either a non-workspace file or there is no workspace.
-        key = utils.normalize_path(pathlib.Path(document.path).parent)
+        key = utils.normalize_path_cached(pathlib.Path(document.path).parent)
         return {
             "cwd": key,
             "workspaceFS": key,
@@ -566,7 +566,7 @@ def _run_tool_on_document(
         # sys.path and that might not work for this scenario next time around.
         with utils.substitute_attr(sys, "path", [""] + sys.path[:]):
             try:
-                result = utils.run_module(
+                result = utils.run(
                     module=TOOL_MODULE,
                     argv=argv,
                     use_stdin=use_stdin,
@@ -639,7 +639,7 @@ def _run_tool(extra_args: Sequence[str], settings: Dict[str, Any]) -> utils.RunR
         # sys.path and that might not work for this scenario next time around.
         with utils.substitute_attr(sys, "path", [""] + sys.path[:]):
             try:
-                result = utils.run_module(
+                result = utils.run(
                     module=TOOL_MODULE, argv=argv, use_stdin=True, cwd=cwd
                 )
             except Exception:
@@ -3,26 +3,43 @@
 """Utility functions and classes for use with running tools over LSP."""
 from __future__ import annotations
 
+import bisect
 import contextlib
+import functools
+import importlib
+import importlib.util
 import io
 import os
 import pathlib
+import queue
 import runpy
 import site
 import subprocess
 import sys
 import sysconfig
 import threading
+from concurrent.futures import Future
 # import re
-from typing import Any, Callable, List, Sequence, Tuple, Union
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
 
 # Save the working directory used when loading this module
 SERVER_CWD = os.getcwd()
 CWD_LOCK = threading.Lock()
 
+# Computed once; the platform cannot change while the server is running.
+_IS_CYGWIN = sys.platform.startswith("cygwin")
+
+# C-level hash lookup beats str.isalpha() method dispatch on the hot
+# drive-letter rejection path.
+_DRIVE_LETTERS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
 
 def as_list(content: Union[Any, List[Any], Tuple[Any]]) -> List[Any]:
     """Ensures we always get a list"""
+    # Exact-type check skips the MRO walk and the callers don't mutate
+    # the result, so an existing list can be returned as-is.
+    if type(content) is list:  # pylint: disable=unidiomatic-typecheck
+        return content
     if isinstance(content, (list, tuple)):
         return list(content)
     return [content]
@@ -43,52 +60,93 @@ def _get_extensions_dir() -> List[str]:
     # The path here is calculated relative to the tool
     # this is because users can launch VS Code with custom
     # extensions folder using the --extensions-dir argument
-    path = pathlib.Path(__file__).parent.parent.parent.parent
-    #                              ^     bundled  ^  extensions
-    #                            tool        <extension>
-    if path.name == "extensions":
-        return [os.fspath(path)]
+    path = os.path.dirname(  # extensions
+        os.path.dirname(  # <extension>
+            os.path.dirname(  # bundled
+                os.path.dirname(os.path.abspath(__file__))  # tool
+            )
+        )
+    )
+    if os.path.basename(path) == "extensions":
+        return [path]
     return []
 
 
-_stdlib_paths = set(
-    str(pathlib.Path(p).resolve())
-    for p in (
-        as_list(site.getsitepackages())
-        + as_list(site.getusersitepackages())
-        + _get_sys_config_paths()
-        + _get_extensions_dir()
-    )
+# Candidate paths are collected cheaply at import; resolving each one
+# (a realpath stat chain per entry, slow on NFS/containers) is deferred
+# to the first is_stdlib_file call so it doesn't delay server startup.
+_stdlib_paths_raw = (
+    as_list(site.getsitepackages())
+    + as_list(site.getusersitepackages())
+    + _get_sys_config_paths()
+    + _get_extensions_dir()
 )
 
+# Sorted so is_stdlib_file can bisect instead of scanning every prefix.
+_stdlib_paths_sorted: List[str] | None = None
+_stdlib_paths_lock = threading.Lock()
+
+
+def _get_stdlib_paths() -> List[str]:
+    """Returns the resolved stdlib path prefixes, computing them once."""
+    global _stdlib_paths_sorted  # pylint: disable=global-statement
+    paths = _stdlib_paths_sorted
+    if paths is None:
+        with _stdlib_paths_lock:
+            if _stdlib_paths_sorted is None:
+                _stdlib_paths_sorted = sorted(
+                    {os.path.realpath(p) for p in _stdlib_paths_raw}
+                )
+            paths = _stdlib_paths_sorted
+    return paths
+
 
+@functools.lru_cache(maxsize=512)
 def is_same_path(file_path1: str, file_path2: str) -> bool:
     """Returns true if two paths are the same."""
-    return pathlib.Path(file_path1) == pathlib.Path(file_path2)
+    return os.path.normcase(os.path.normpath(file_path1)) == os.path.normcase(
+        os.path.normpath(file_path2)
+    )
 
 def win_path_to_posix(path: str) -> str:
     """
     自动识别并转换 Windows 带盘符路径为 POSIX 格式（如 D:/tmp → /d/tmp），
     非 Windows 路径原样返回。
     """
-    # print(type(path))
-    if not isinstance(path, str):
-        return path
-    if not sys.platform.startswith('cygwin'):
+    if not _IS_CYGWIN:
         # print("not cygwin")
         return path
+    # print(type(path))
+    if not isinstance(path, str):
+        # PathLike 对象取其底层字符串（os.fspath 为 C 级协议调用），
+        # 其他类型原样返回
+        try:
+            path = os.fspath(path)
+        except TypeError:
+            return path
+        if not isinstance(path, str):
+            return path
 
     # 快速判断：是否以 "X:\" 或 "X:/" 开头（X 为字母）
     # 快速初步检查：长度至少3，且第2个字符是 ':'，第3个是 '/' 或 '\\'
     # 例如: "C:/", "d:\\"
-    if len(path) < 3 or path[1] != ':' or path[2] not in ('/', '\\'):
-        return path
-    # 检查第一个字符是否为字母（A-Z, a-z）
-    if not path[0].isalpha():
+    if (
+        len(path) < 3
+        or path[1] != ':'
+        or path[2] not in ('/', '\\')
+        # 检查第一个字符是否为字母（A-Z, a-z）
+        or path[0] not in _DRIVE_LETTERS
+    ):
         return path
     # if not re.match(r'^[a-zA-Z]:[/\\]', path):
         # return path
 
+    return _win_to_posix_cached(path)
+
+
+@functools.lru_cache(maxsize=2048)
+def _win_to_posix_cached(path: str) -> str:
+    """Converts a drive-letter path to POSIX form, caching repeated inputs."""
     try:
         p = pathlib.PureWindowsPath(path)
         if not p.drive or not p.is_absolute():
@@ -107,18 +165,50 @@ def win_path_to_posix(path: str) -> str:
 
 def normalize_path(file_path: str) -> str:
     """Returns normalized path."""
-    return str(pathlib.Path(win_path_to_posix(str(file_path))).resolve())
+    # Path(...).resolve() is realpath plus a Path allocation and str()
+    # round-trips; call realpath directly. os.fspath unwraps PathLike
+    # arguments without the __str__ dispatch that str() would pay.
+    return os.path.realpath(win_path_to_posix(os.fspath(file_path)))
+
+
+def normalize_path_fast(file_path: str) -> str:
+    """Normalizes a path without resolving symlinks (no stat syscalls).
+
+    Suitable for comparisons where symlink identity does not matter.
+    """
+    return os.path.normcase(os.path.normpath(win_path_to_posix(os.fspath(file_path))))
+
+
+# Cached variant for hot paths; LSP requests repeat the same handful of
+# workspace paths, so the `.resolve()` syscalls only need to happen once.
+# Use plain `normalize_path` when fresh symlink resolution is required.
+normalize_path_cached = functools.lru_cache(maxsize=1024)(normalize_path)
 
 
 def is_current_interpreter(executable) -> bool:
     """Returns true if the executable path is same as the current interpreter."""
+    if executable == sys.executable:
+        return True
     return is_same_path(executable, sys.executable)
 
 
+@functools.lru_cache(maxsize=512)
 def is_stdlib_file(file_path: str) -> bool:
     """Return True if the file belongs to the standard library."""
     normalized_path = str(pathlib.Path(file_path).resolve())
-    return any(normalized_path.startswith(path) for path in _stdlib_paths)
+    stdlib_paths = _get_stdlib_paths()
+    # Any matching prefix sorts at or before the path, so the bisect
+    # predecessor is almost always the answer in one startswith check.
+    idx = bisect.bisect_right(stdlib_paths, normalized_path) - 1
+    if idx < 0:
+        # The path sorts before every prefix, so no prefix can match
+        # (and stdlib_paths[:idx] would be a negative slice below).
+        return False
+    if normalized_path.startswith(stdlib_paths[idx]):
+        return True
+    # Nested install dirs (e.g. lib/pythonX.Y and its site-packages) can
+    # shadow a shorter prefix at the probe point; scan the few entries below.
+    return any(normalized_path.startswith(path) for path in stdlib_paths[:idx])
 
 
 # pylint: disable-next=too-few-public-methods
@@ -146,8 +236,57 @@ class CustomIO(io.TextIOWrapper):
 
     def get_value(self) -> str:
         """Returns value from the buffer as string."""
+        # Read the raw bytes and decode once instead of seek+read through
+        # the text wrapper, which would re-decode via its read buffer.
+        self.flush()
+        return self._buffer.getvalue().decode(self.encoding)
+
+    def get_bytes(self) -> bytes:
+        """Returns value from the buffer as bytes, skipping the decode."""
+        self.flush()
+        return self._buffer.getvalue()
+
+    def reset(self) -> None:
+        """Clears the buffer so the stream can be reused for a new capture."""
         self.seek(0)
-        return self.read()
+        self.truncate()
+
+
+# Per-thread reusable capture streams; every request needs the same two
+# (sometimes three) buffers, so reuse them instead of churning the
+# allocator under bursts of requests.
+_io_pool = threading.local()
+
+
+def _acquire_io() -> Tuple[CustomIO, CustomIO]:
+    """Returns this thread's stdout/stderr capture buffers, cleared."""
+    bufs = getattr(_io_pool, "bufs", None)
+    if bufs is None:
+        bufs = (
+            CustomIO("<stdout>", encoding="utf-8"),
+            CustomIO("<stderr>", encoding="utf-8"),
+        )
+        _io_pool.bufs = bufs
+    bufs[0].reset()
+    bufs[1].reset()
+    return bufs
+
+
+def _acquire_stdin(source: str) -> CustomIO:
+    """Returns this thread's stdin substitute preloaded with the source."""
+    buf = getattr(_io_pool, "stdin", None)
+    if buf is None:
+        buf = CustomIO("<stdin>", encoding="utf-8", newline="\n")
+        _io_pool.stdin = buf
+    # Encode straight into the byte buffer: writing the text through the
+    # wrapper would run the codec here and again when the tool reads it
+    # back. This way the source only passes through the codec on read.
+    raw = buf._buffer  # pylint: disable=protected-access
+    raw.seek(0)
+    raw.truncate()
+    raw.write(source.encode("utf-8"))
+    buf.seek(0)
+    return buf
 
 
 @contextlib.contextmanager
@@ -155,8 +294,10 @@ def substitute_attr(obj: Any, attribute: str, new_value: Any):
     """Manage object attributes context when using runpy.run_module()."""
     old_value = getattr(obj, attribute)
     setattr(obj, attribute, new_value)
-    yield
-    setattr(obj, attribute, old_value)
+    try:
+        yield
+    finally:
+        setattr(obj, attribute, old_value)
 
 
 @contextlib.contextmanager
@@ -164,58 +305,179 @@ def redirect_io(stream: str, new_stream):
     """Redirect stdio streams to a custom stream."""
     old_stream = getattr(sys, stream)
     setattr(sys, stream, new_stream)
-    yield
-    setattr(sys, stream, old_stream)
+    try:
+        yield
+    finally:
+        setattr(sys, stream, old_stream)
 
 
 @contextlib.contextmanager
 def change_cwd(new_cwd):
     """Change working directory before running code."""
     os.chdir(new_cwd)
-    yield
-    os.chdir(SERVER_CWD)
+    try:
+        yield
+    finally:
+        os.chdir(SERVER_CWD)
 
 
-def _run_module(
-    module: str, argv: Sequence[str], use_stdin: bool, source: str = None
-) -> RunResult:
-    """Runs as a module."""
-    str_output = CustomIO("<stdout>", encoding="utf-8")
-    str_error = CustomIO("<stderr>", encoding="utf-8")
+# Entry-point callables resolved once per module; re-running the tool's
+# import chain (runpy re-executes __main__ every time) dwarfs the actual
+# work for small files.
+_ENTRY_CACHE: Dict[str, Callable[[], Any]] = {}
+
 
+def _module_entry(module: str) -> Callable[[], Any]:
+    """Returns a cached entry point for the module, importing it once."""
     try:
-        with substitute_attr(sys, "argv", argv):
-            with redirect_io("stdout", str_output):
-                with redirect_io("stderr", str_error):
-                    if use_stdin and source is not None:
-                        str_input = CustomIO("<stdin>", encoding="utf-8", newline="\n")
-                        with redirect_io("stdin", str_input):
-                            str_input.write(source)
-                            str_input.seek(0)
-                            runpy.run_module(module, run_name="__main__")
-                    else:
-                        runpy.run_module(module, run_name="__main__")
-    except SystemExit:
+        return _ENTRY_CACHE[module]
+    except KeyError:
         pass
 
-    return RunResult(str_output.get_value(), str_error.get_value())
+    entry = None
+    try:
+        mod = importlib.import_module(module)
+        # black exposes patched_main; most click/argparse tools expose main.
+        # Both read sys.argv, which _worker_loop substitutes before calling.
+        entry = getattr(mod, "patched_main", None) or getattr(mod, "main", None)
+    except Exception:  # pylint: disable=broad-except
+        entry = None
+
+    if not callable(entry):
+        # No usable entry point; fall back to re-executing __main__.
+        entry = functools.partial(runpy.run_module, module, run_name="__main__")
+
+    _ENTRY_CACHE[module] = entry
+    return entry
+
+
+# Single worker thread for run_module requests. Running the tool mutates
+# process-global state (sys.argv/stdout/stderr and possibly the cwd), so
+# one executor thread is the natural model — and it lets a burst of
+# requests (save-all, format-on-type) share one stdio redirection instead
+# of paying setup/teardown per request. Started lazily on first use.
+_worker_queue: queue.Queue | None = None
+_worker_lock = threading.Lock()
+
+
+def _ensure_worker() -> queue.Queue:
+    """Starts the run_module worker thread on first use."""
+    global _worker_queue  # pylint: disable=global-statement
+    if _worker_queue is None:
+        with _worker_lock:
+            if _worker_queue is None:
+                requests = queue.Queue()
+                threading.Thread(
+                    target=_worker_loop,
+                    args=(requests,),
+                    name="run_module-worker",
+                    daemon=True,
+                ).start()
+                _worker_queue = requests
+    return _worker_queue
+
+
+# Last working directory this thread confirmed, so repeated requests for
+# the same workspace skip the getcwd syscall and the lock entirely. Valid
+# because everyone who chdirs (change_cwd under CWD_LOCK) restores
+# SERVER_CWD before releasing the lock, and run_module executes on the
+# single worker thread.
+_cwd_state = threading.local()
+
+
+def _run_in_cwd(entry: Callable[[], Any], cwd: str) -> None:
+    """Invokes entry under the requested cwd, only locking when it must chdir."""
+    known_cwd = getattr(_cwd_state, "cwd", None)
+    if known_cwd is None:
+        known_cwd = os.getcwd()
+        _cwd_state.cwd = known_cwd
+    if is_same_path(known_cwd, cwd):
+        entry()
+        return
+    try:
+        with CWD_LOCK:
+            with change_cwd(cwd):
+                entry()
+    finally:
+        # change_cwd restores SERVER_CWD on the way out.
+        _cwd_state.cwd = SERVER_CWD
+
+
+def _worker_loop(requests: queue.Queue) -> None:
+    """Processes run_module requests, batching bursts under one redirect."""
+    while True:
+        item = requests.get()
+
+        str_output, str_error = _acquire_io()
+        old_argv, old_stdout, old_stderr, old_stdin = (
+            sys.argv,
+            sys.stdout,
+            sys.stderr,
+            sys.stdin,
+        )
+        try:
+            while item is not None:
+                module, argv, use_stdin, cwd, source, future = item
+                try:
+                    str_output.reset()
+                    str_error.reset()
+                    sys.argv = argv
+                    sys.stdout, sys.stderr = str_output, str_error
+                    if use_stdin and source is not None:
+                        sys.stdin = _acquire_stdin(source)
+                    else:
+                        sys.stdin = old_stdin
+
+                    try:
+                        _run_in_cwd(_module_entry(module), cwd)
+                    except SystemExit:
+                        pass
+                    future.set_result(
+                        RunResult(str_output.get_value(), str_error.get_value())
+                    )
+                except BaseException as exc:  # pylint: disable=broad-except
+                    future.set_exception(exc)
+
+                # Drain any requests that arrived while running; they reuse
+                # the redirection already in place.
+                try:
+                    item = requests.get_nowait()
+                except queue.Empty:
+                    item = None
+        finally:
+            sys.argv, sys.stdout, sys.stderr, sys.stdin = (
+                old_argv,
+                old_stdout,
+                old_stderr,
+                old_stdin,
+            )
 
 
 def run_module(
     module: str, argv: Sequence[str], use_stdin: bool, cwd: str, source: str = None
 ) -> RunResult:
     """Runs as a module."""
-    with CWD_LOCK:
-        if is_same_path(os.getcwd(), cwd):
-            return _run_module(module, argv, use_stdin, source)
-        with change_cwd(cwd):
-            return _run_module(module, argv, use_stdin, source)
+    future = Future()
+    _ensure_worker().put((module, argv, use_stdin, cwd, source, future))
+    return future.result()
+
+
+# Default pipe capacity on Linux; stdin payloads below this can be
+# written in one shot without risking a blocking write. Only trusted on
+# POSIX — Windows anonymous pipes default to a much smaller buffer, so
+# the fast path in run_path stays off there.
+_PIPE_BUF_SIZE = 65536
 
 
 def run_path(
     argv: Sequence[str], use_stdin: bool, cwd: str, source: str = None
 ) -> RunResult:
-    """Runs as an executable."""
+    """Runs as an executable.
+
+    This spawns a subprocess (fork/exec plus interpreter startup) per
+    request; prefer `run` / `run_api` / `run_module`, which stay
+    in-process, whenever the tool is importable.
+    """
     if use_stdin:
         with subprocess.Popen(
             argv,
@@ -225,6 +487,24 @@ def run_path(
             stdin=subprocess.PIPE,
             cwd=cwd,
         ) as process:
+            if (
+                sys.platform != "win32"
+                and source is not None
+                and len(source.encode("utf-8")) < _PIPE_BUF_SIZE
+            ):
+                # POSIX only: the payload fits in the pipe buffer, so the
+                # synchronous write cannot block; communicate() then only
+                # flushes+closes stdin and drains stdout/stderr. On
+                # Windows the pipe is smaller and communicate()'s stdin
+                # feeder thread is what prevents a write/read deadlock
+                # against a streaming child, so keep it there.
+                try:
+                    process.stdin.write(source)
+                except BrokenPipeError:
+                    # Child exited before reading stdin; communicate()
+                    # swallows this itself and still collects the output.
+                    pass
+                return RunResult(*process.communicate())
             return RunResult(*process.communicate(input=source))
     else:
         result = subprocess.run(
@@ -238,6 +518,28 @@ def run_path(
         return RunResult(result.stdout, result.stderr)
 
 
+@functools.lru_cache(maxsize=32)
+def _is_importable(module: str) -> bool:
+    """Returns True if the module can be imported in this process."""
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def run(
+    module: str, argv: Sequence[str], use_stdin: bool, cwd: str, source: str = None
+) -> RunResult:
+    """Runs the tool, preferring in-process execution.
+
+    Dispatches to `run_module` when the module is importable and only
+    falls back to `run_path` (a subprocess per request) when it is not.
+    """
+    if _is_importable(module):
+        return run_module(module, argv, use_stdin, cwd, source)
+    return run_path(argv, use_stdin, cwd, source)
+
+
 def run_api(
     callback: Callable[[Sequence[str], CustomIO, CustomIO, CustomIO | None], None],
     argv: Sequence[str],
@@ -246,9 +548,9 @@ def run_api(
     source: str = None,
 ) -> RunResult:
     """Run a API."""
+    if is_same_path(os.getcwd(), cwd):
+        return _run_api(callback, argv, use_stdin, source)
     with CWD_LOCK:
-        if is_same_path(os.getcwd(), cwd):
-            return _run_api(callback, argv, use_stdin, source)
         with change_cwd(cwd):
             return _run_api(callback, argv, use_stdin, source)
 
@@ -259,22 +561,23 @@ def _run_api(
     use_stdin: bool,
     source: str = None,
 ) -> RunResult:
-    str_output = CustomIO("<stdout>", encoding="utf-8")
-    str_error = CustomIO("<stderr>", encoding="utf-8")
+    str_output, str_error = _acquire_io()
 
+    old_argv, old_stdout, old_stderr = sys.argv, sys.stdout, sys.stderr
+    old_stdin = sys.stdin if use_stdin and source is not None else None
+    sys.argv, sys.stdout, sys.stderr = argv, str_output, str_error
     try:
-        with substitute_attr(sys, "argv", argv):
-            with redirect_io("stdout", str_output):
-                with redirect_io("stderr", str_error):
-                    if use_stdin and source is not None:
-                        str_input = CustomIO("<stdin>", encoding="utf-8", newline="\n")
-                        with redirect_io("stdin", str_input):
-                            str_input.write(source)
-                            str_input.seek(0)
-                            callback(argv, str_output, str_error, str_input)
-                    else:
-                        callback(argv, str_output, str_error)
+        if use_stdin and source is not None:
+            str_input = _acquire_stdin(source)
+            sys.stdin = str_input
+            callback(argv, str_output, str_error, str_input)
+        else:
+            callback(argv, str_output, str_error)
     except SystemExit:
         pass
+    finally:
+        sys.argv, sys.stdout, sys.stderr = old_argv, old_stdout, old_stderr
+        if old_stdin is not None:
+            sys.stdin = old_stdin
 
     return RunResult(str_output.get_value(), str_error.get_value())